@@ -1,4 +1,6 @@
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from time import sleep
 
 import numpy as np
@@ -15,127 +17,177 @@ metric_name = "overall_acc"
 # metric = "roc_micro"
 
 
-def wandb_to_df(project_names, metric="overall_acc"):
-    project_runs = {}
-    for project_name in project_names:
-        print(f"Downloading project {project_name}")
-        try_again = True
-        while try_again:
-            try:
-                # Moving api inside loop since I need to `reset` the session when having timeout errors...
-                api = wandb.Api()
-                project_runs[project_name] = [
-                    r for r in api.runs(project_name, {}) if r.state == "finished"
-                ]
-                try_again = False
-            except Exception as e:
-                print(f"Trying again {project_name} - {e}")
-                sleep(5)
-
-    dicts = []
+def _download_project_runs(api, project_name):
+    print(f"Downloading project {project_name}")
+    try_again = True
+    while try_again:
+        try:
+            runs = [r for r in api.runs(project_name, {}) if r.state == "finished"]
+            try_again = False
+        except Exception as e:
+            print(f"Trying again {project_name} - {e}")
+            sleep(5)
+            # New api since I need to `reset` the session when having timeout errors...
+            api = wandb.Api()
+
+    return runs
+
+
+def wandb_to_df(project_names, metric="overall_acc", max_workers=8):
+    # Downloads are network bound, so projects are fetched concurrently.
+    api = wandb.Api()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        project_runs = dict(
+            zip(
+                project_names,
+                executor.map(partial(_download_project_runs, api), project_names),
+            )
+        )
+
+    # metric_pattern = re.compile(f"(valid|test)_(drl|trained|untrained|raw).*{metric}.*")
+    metric_pattern = re.compile(f"test.*{metric}.*")
+    meta_rows = []
+    metric_rows = []
     for k in project_runs.keys():
         runs = project_runs[k]
         for r in runs:
-            metrics = {
-                k: r.summary[k]
-                for k in r.summary.keys()
-                if re.search(
-                    # f"(valid|test)_(drl|trained|untrained|raw).*{metric}.*",
-                    f"test.*{metric}.*",
-                    k,
-                )
-            }
-            d = {
-                "project": r.project,
-                "dataset_name": r.config["training"]["dataset"],
-                # "config": r.config,
-                **metrics,
-            }
-            dicts.append(d)
-
-    df = pd.DataFrame(dicts)
+            meta_rows.append(
+                {
+                    "project": r.project,
+                    "dataset_name": r.config["training"]["dataset"],
+                    # "config": r.config,
+                }
+            )
+            metric_rows.append(
+                {k: r.summary[k] for k in r.summary.keys() if metric_pattern.search(k)}
+            )
+
+    # Explicit float32 avoids object dtype inference and halves the memory used by the statistics.
+    meta_df = pd.DataFrame(meta_rows, columns=["project", "dataset_name"])
+    metrics_df = pd.DataFrame(metric_rows, dtype="float32")
+    df = pd.concat([meta_df, metrics_df], axis=1)
     return df
 
 
+WILCOXON_COLUMNS = [
+    "project",
+    "dataset_name",
+    "g1_count",
+    "g1",
+    "g1_mean",
+    "g1_std",
+    "g2_count",
+    "g2",
+    "g2_mean",
+    "g2_std",
+    "wilcoxon_result",
+    "statistic",
+    "p-value",
+]
+
+
+def _sorted_categorical(codes, categories):
+    # Sorting a categorical follows its categories, so they are kept lexicographic as plain strings would be.
+    categories = list(categories)
+    return pd.Categorical.from_codes(codes, categories).reorder_categories(sorted(categories))
+
+
 def wilcoxon_tests(df, metric):
-    results = []
-    dataset_names = df["dataset_name"].unique()
-    df_melted = df.melt(["project", "dataset_name"])
-    df_melted["group"] = df_melted["project"] + "-" + df_melted["variable"]
-    groups = df_melted["variable"].unique()
-    projects = df_melted["project"].unique()
-    # groups = df_melted["group"].unique()
-    # df_melted = df_melted.drop(["project", "variable"], axis=1)
-    df_melted = df_melted.dropna()
-    # groups = df_melted["group"].unique()
-    for dataset_name in dataset_names:
-        df_current_dataset = df_melted[df_melted["dataset_name"] == dataset_name]
-        for project in projects:
-            df_current_dataset_project = df_current_dataset[
-                df_current_dataset["project"] == project
-            ]
-            for g1 in groups:
-                for g2 in groups:
-                    if re.match(f".*_autoconstructive_.*{metric}.*", g1) and re.match(
-                        r".*[knn\-1|knn\-3|svm|xgboost|rf|drl].*", g2
-                    ):
-                        if g1 != g2:
-                            df1 = df_current_dataset_project[
-                                df_current_dataset_project["variable"] == g1
-                            ]
-                            df2 = df_current_dataset_project[
-                                df_current_dataset_project["variable"] == g2
-                            ]
-                            if df1.shape[0] < 2 or df2.shape[0] < 2:
-                                continue
-                            g1_over_g2 = "d"
-                            stat = 999
-                            p = 999
-
-                            values1 = df1["value"].to_numpy()
-                            values2 = df2["value"].to_numpy()
-
-                            if any(values1 != values2):
-                                stat, p = wilcoxon(values1, values2)
-                            if p < 0.05:
-                                if values1.mean() > values2.mean():
-                                    g1_over_g2 = "w"
-                                else:
-                                    g1_over_g2 = "l"
-                            results.append(
-                                {
-                                    "project": project,
-                                    "dataset_name": dataset_name,
-                                    "g1_count": len(values1),
-                                    "g1": g1,
-                                    "g1_mean": values1.mean(),
-                                    "g1_std": values1.std(),
-                                    "g2_count": len(values2),
-                                    "g2": g2,
-                                    "g2_mean": values2.mean(),
-                                    "g2_std": values2.std(),
-                                    "wilcoxon_result": g1_over_g2,
-                                    "statistic": stat,
-                                    "p-value": p,
-                                }
-                            )
+    # Each row of `df` is a run, so the wide frame already is the (run, variable) pivot.
+    groups = df.columns.drop(["project", "dataset_name"])
+    g1_pattern = re.compile(f".*_autoconstructive_.*{metric}.*")
+    g2_pattern = re.compile(r".*[knn\-1|knn\-3|svm|xgboost|rf|drl].*")
+    g1_candidates = [i for i, g in enumerate(groups) if g1_pattern.match(g)]
+    g2_candidates = [i for i, g in enumerate(groups) if g2_pattern.match(g)]
+    pairs = [(i1, i2) for i1 in g1_candidates for i2 in g2_candidates if i1 != i2]
+    g1_idx = np.array([i1 for i1, _ in pairs], dtype=int)
+    g2_idx = np.array([i2 for _, i2 in pairs], dtype=int)
+
+    all_values = df[groups].to_numpy(dtype=float)  # [n_total_runs, n_groups]
+    dataset_project__run_ixs = df.groupby(["dataset_name", "project"], sort=False).indices
+
+    # Upper bound on the number of result rows, filled up to `num_rows`.
+    max_rows = len(dataset_project__run_ixs) * len(pairs)
+    project_codes = np.empty(max_rows, dtype=np.int32)
+    dataset_name_codes = np.empty(max_rows, dtype=np.int32)
+    g1_codes = np.empty(max_rows, dtype=np.int32)
+    g2_codes = np.empty(max_rows, dtype=np.int32)
+    g1_counts = np.empty(max_rows, dtype=np.int64)
+    g2_counts = np.empty(max_rows, dtype=np.int64)
+    g1_means = np.empty(max_rows, dtype=np.float32)
+    g2_means = np.empty(max_rows, dtype=np.float32)
+    g1_stds = np.empty(max_rows, dtype=np.float32)
+    g2_stds = np.empty(max_rows, dtype=np.float32)
+    wilcoxon_results = np.empty(max_rows, dtype="<U1")
+    statistics = np.empty(max_rows, dtype=np.float64)
+    p_values = np.empty(max_rows, dtype=np.float64)
+    projects = {}
+    dataset_names = {}
+    num_rows = 0
+
+    for (dataset_name, project), run_ixs in dataset_project__run_ixs.items():
+        values = all_values[run_ixs]  # [n_runs, n_groups]
+        counts = (~np.isnan(values)).sum(0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.nansum(values, 0) / counts
+            stds = np.sqrt(np.nansum((values - means) ** 2, 0) / counts)
+
+        valid = (counts[g1_idx] >= 2) & (counts[g2_idx] >= 2)
+        if not valid.any():
+            continue
+        i1 = g1_idx[valid]
+        i2 = g2_idx[valid]
+
+        differences = values[:, i1] - values[:, i2]  # [n_runs, n_pairs]
+        differs = (np.nan_to_num(differences) != 0).any(0)
+        stat = np.full(len(i1), 999.0)
+        p = np.full(len(i1), 999.0)
+        # scipy picks the exact or an approximate method from the ties and zeros of the whole
+        # array, so pairs with tied or zero differences are tested apart from the others.
+        abs_differences = np.sort(np.abs(differences), axis=0)  # NaNs are sorted last.
+        tied = (abs_differences == 0).any(0) | (np.diff(abs_differences, axis=0) == 0).any(0)
+        for columns in [differs & ~tied, differs & tied]:
+            if columns.any():
+                stat[columns], p[columns] = wilcoxon(
+                    differences[:, columns], axis=0, zero_method="wilcox", nan_policy="omit"
+                )
+
+        rows = slice(num_rows, num_rows + len(i1))
+        project_codes[rows] = projects.setdefault(project, len(projects))
+        dataset_name_codes[rows] = dataset_names.setdefault(dataset_name, len(dataset_names))
+        g1_codes[rows] = i1
+        g2_codes[rows] = i2
+        g1_counts[rows] = counts[i1]
+        g2_counts[rows] = counts[i2]
+        g1_means[rows] = means[i1]
+        g2_means[rows] = means[i2]
+        g1_stds[rows] = stds[i1]
+        g2_stds[rows] = stds[i2]
+        wilcoxon_results[rows] = np.where(
+            p < 0.05, np.where(means[i1] > means[i2], "w", "l"), "d"
+        )
+        statistics[rows] = stat
+        p_values[rows] = p
+        num_rows += len(i1)
+
+    rows = slice(0, num_rows)
     df = pd.DataFrame(
-        results,
-        columns=[
-            "project",
-            "dataset_name",
-            "g1_count",
-            "g1",
-            "g1_mean",
-            "g1_std",
-            "g2_count",
-            "g2",
-            "g2_mean",
-            "g2_std",
-            "wilcoxon_result",
-            "statistic",
-            "p-value",
-        ],
+        {
+            "project": _sorted_categorical(project_codes[rows], projects),
+            "dataset_name": _sorted_categorical(dataset_name_codes[rows], dataset_names),
+            "g1_count": g1_counts[rows],
+            "g1": _sorted_categorical(g1_codes[rows], groups),
+            "g1_mean": g1_means[rows],
+            "g1_std": g1_stds[rows],
+            "g2_count": g2_counts[rows],
+            "g2": _sorted_categorical(g2_codes[rows], groups),
+            "g2_mean": g2_means[rows],
+            "g2_std": g2_stds[rows],
+            "wilcoxon_result": wilcoxon_results[rows],
+            "statistic": statistics[rows],
+            "p-value": p_values[rows],
+        },
+        columns=WILCOXON_COLUMNS,
     )
     df = df.sort_values(["g1", "dataset_name", "wilcoxon_result"])
     return df
@@ -52,6 +52,8 @@ class AutoConstructiveModel(nn.Module):
         loss_rel_tol: float = 0.05,
         min_improvement: float=0.001,
         device: str = "cuda",
+        compile_forward: bool = False,
+        mixed_precision: bool = False,
         random_state: int = 0,
         logger: Any = None,
     ):
@@ -79,6 +81,8 @@ class AutoConstructiveModel(nn.Module):
         self.loss_rel_tol = loss_rel_tol
         self.min_improvement = min_improvement
         self.device: str = device
+        self.compile_forward = compile_forward
+        self.mixed_precision = mixed_precision
         self.random_state = random_state
         torch.manual_seed(random_state)
         if logger is None:
@@ -135,6 +139,8 @@ class AutoConstructiveModel(nn.Module):
             activations=self.activations,
             bias=True,
             device=self.device,
+            compile_forward=self.compile_forward,
+            mixed_precision=self.mixed_precision,
             logger=self.logger,
         ).to(self.device)
         end = perf_counter()
@@ -1,3 +1,4 @@
+import contextlib
 from copy import deepcopy
 from functools import partial
 from itertools import groupby
@@ -54,18 +55,15 @@ def build_model_ids(
 
     num_activations = len(activation_functions)
 
-    neurons_structure = torch.arange(min_neurons, max_neurons + 1, step).tolist()
+    neurons_structure = np.arange(min_neurons, max_neurons + 1, step)
     num_different_neurons_structures = len(neurons_structure)
     num_parallel_mlps = num_different_neurons_structures * num_activations * repetitions
 
-    i = 0
-    hidden_neuron__model_id = []
-    while i < num_parallel_mlps:
-        for structure in neurons_structure:
-            hidden_neuron__model_id += [i] * structure
-            i += 1
+    model_ids = np.arange(num_parallel_mlps)
+    model_id__num_hidden_neurons = np.tile(neurons_structure, num_activations * repetitions)
+    hidden_neuron__model_id = np.repeat(model_ids, model_id__num_hidden_neurons).tolist()
 
-    output__model_id = [i[0] for i in groupby(hidden_neuron__model_id)]
+    output__model_id = model_ids.tolist()
     output__architecture_id = output__model_id[:num_activations * num_different_neurons_structures] * repetitions
 
     return hidden_neuron__model_id, output__model_id, output__architecture_id
@@ -82,6 +80,8 @@ class ParallelMLPs(nn.Module):
         activations: List[nn.Module],
         bias: bool = True,
         device: str = "cuda",
+        compile_forward: bool = False,
+        mixed_precision: bool = False,
         logger: Any= None
     ):
         super().__init__()
@@ -89,33 +89,43 @@ class ParallelMLPs(nn.Module):
         self.in_features = in_features
         self.out_features = out_features
         self.activations = activations
+        self.mixed_precision = mixed_precision
         self.logger = logger
 
         # Mappings: index -> id
-        self.hidden_neuron__model_id = (
-            torch.Tensor(hidden_neuron__model_id).long().to(self.device)
+        host_hidden_neuron__model_id = torch.as_tensor(np.asarray(hidden_neuron__model_id, dtype=np.int64))
+        self.hidden_neuron__model_id = host_hidden_neuron__model_id.to(self.device)
+        self.output__model_id = torch.as_tensor(
+            np.asarray(output__model_id, dtype=np.int64), device=self.device
+        )
+        self.output__architecture_id = torch.as_tensor(
+            np.asarray(output__architecture_id, dtype=np.int64), device=self.device
         )
-        self.output__model_id = torch.Tensor(output__model_id).long().to(self.device)
-        self.output__architecture_id = torch.Tensor(output__architecture_id).long().to(self.device)
 
         self.total_hidden_neurons = len(self.hidden_neuron__model_id)
         self.unique_model_ids = sorted(list(set(hidden_neuron__model_id)))
-        self.model_id__num_hidden_neurons = torch.from_numpy(
-            np.bincount(self.hidden_neuron__model_id.cpu().numpy())
-        ).to(self.device)
-        # self.model_id__start_neuron = torch.zeros_like(self.model_id__num_hidden_neurons)
-        self.model_id__start_idx = torch.cat([torch.tensor([0]).to(self.device), self.model_id__num_hidden_neurons.cumsum(0)[:-1]])
-        self.model_id__end_idx = self.model_id__start_idx + self.model_id__num_hidden_neurons
-        # self.model_id__start_neuron = 
-
-        # self.model_id__num_hidden_neurons = torch.bincount(
-        #     self.hidden_neuron__model_id
-        # ).to(self.device)
+        # Counts and offsets are computed once on the host from the id list. The offsets stay there (they are
+        # only read as Python ints), while the counts are also kept on the device for callers indexing them
+        # with device tensors (e.g. helpers.min_ix_argmin).
+        model_id__num_hidden_neurons = torch.bincount(host_hidden_neuron__model_id)
+        self.model_id__end_idx = model_id__num_hidden_neurons.cumsum(0)
+        self.model_id__start_idx = nn.functional.pad(self.model_id__end_idx, (1, 0))[:-1]
+        self.model_id__num_hidden_neurons = model_id__num_hidden_neurons.to(self.device)
 
         self.num_unique_models = len(self.unique_model_ids)
         self.num_activations = len(activations)
 
         self.activations_split = self.total_hidden_neurons // self.num_activations
+        if self.activations_split * self.num_activations != self.total_hidden_neurons:
+            raise RuntimeError(
+                f"total_hidden_neurons {self.total_hidden_neurons} can not be evenly split among {self.num_activations} activations."
+            )
+        self.activation_slices = [
+            (act, i * self.activations_split, (i + 1) * self.activations_split)
+            for i, act in enumerate(self.activations)
+        ]
+
+        self._build_size_classes()
 
         self.hidden_layer = nn.Linear(self.in_features, self.total_hidden_neurons)
         self.weight = Parameter(
@@ -133,66 +143,143 @@ class ParallelMLPs(nn.Module):
         self.to(device)
         self.logger.info(f"Model sent to {device}!")
 
+        if compile_forward:
+            # Lets Inductor fuse the gathers, activations and per-group bmm calls of forward.
+            self.compile(mode="reduce-overhead", dynamic=False)
+
     def _build_outputs_ids(self):
         return [i[0] for i in groupby(self.hidden_neuron__model_id)]
 
+    def _build_size_classes(self):
+        """Groups the models by number of hidden neurons, so each group's output layer is a single bmm.
+
+        Sets:
+            size_classes: List of (num_models, num_neurons) per group.
+            size_class__split_sizes: Number of hidden neurons of each group, in size_classes order.
+            size_class__neuron_ids: Permutation laying the hidden neurons out group after group, or None
+                when they already are (no gather needed).
+            size_class__model_position: Index reordering the concatenated group outputs by model_id, or None
+                when they are already ordered.
+        """
+        num_hidden_neurons = self.model_id__end_idx - self.model_id__start_idx
+        start_idx = self.model_id__start_idx
+
+        self.size_classes = []
+        size_class__neuron_ids = []
+        size_class__model_ids = []
+        for num_neurons in num_hidden_neurons.unique().tolist():
+            model_ids = torch.where(num_hidden_neurons == num_neurons)[0]
+            neuron_ids = (start_idx[model_ids, None] + torch.arange(num_neurons)[None, :]).reshape(-1)
+            self.size_classes.append((len(model_ids), num_neurons))
+            size_class__neuron_ids.append(neuron_ids)
+            size_class__model_ids.append(model_ids)
+
+        self.size_class__split_sizes = [len(neuron_ids) for neuron_ids in size_class__neuron_ids]
+        self.size_class__neuron_ids = None
+        self.size_class__model_position = None
+        if len(self.size_classes) > 1:
+            self.size_class__neuron_ids = torch.cat(size_class__neuron_ids).to(self.device)
+            self.size_class__model_position = torch.argsort(torch.cat(size_class__model_ids)).to(self.device)
 
 
     def reset_parameters(self, layer_ids=None):
-        if layer_ids == None:
-            layer_ids = self.unique_model_ids
+        # For 2D weights, kaiming_uniform_(a=sqrt(5)) samples U(-1/sqrt(fan_in), 1/sqrt(fan_in)), the same bound
+        # used for the biases. fan_in is in_features for the hidden layer and the model's number of hidden
+        # neurons for the output layer, so the bounds are known without slicing per model.
+        device = self.weight.device
+        hidden_bound = 1 / math.sqrt(self.in_features)
+        # Host offsets: no copies while the weights are still on the host in __init__.
+        num_hidden_neurons = (self.model_id__end_idx - self.model_id__start_idx).to(device)
+        model_id__out_bound = num_hidden_neurons.float().rsqrt()
 
         with torch.no_grad():
-            for layer_id in layer_ids:
-                start = self.model_id__start_idx[layer_id]
-                end = self.model_id__end_idx[layer_id]
-                hidden_w = self.hidden_layer.weight[start:end, :]
-                hidden_b = self.hidden_layer.bias[start:end]
-
-                out_w = self.weight[:, start:end]
-                out_b = self.bias[layer_id, :]
-
-                for w, b in [(hidden_w, hidden_b), (out_w, out_b)]:
-                    init.kaiming_uniform_(w, a=math.sqrt(5))
-                    fan_in, _ = init._calculate_fan_in_and_fan_out(w)
-                    bound = 1 / math.sqrt(fan_in)
-                    init.uniform_(b, -bound, bound)
+            if layer_ids is None:
+                hidden_neuron__out_bound = model_id__out_bound.repeat_interleave(num_hidden_neurons)
+                init.kaiming_uniform_(self.hidden_layer.weight, a=math.sqrt(5))
+                self.hidden_layer.bias.uniform_(-hidden_bound, hidden_bound)
+                self.weight.uniform_(-1, 1).mul_(hidden_neuron__out_bound[None, :])
+                if self.bias is not None:
+                    self.bias.uniform_(-1, 1).mul_(model_id__out_bound[:, None])
+                return
+
+            # Only called once the model is built, so the id mapping already is on the weights' device.
+            hidden_neuron__model_id = self.hidden_neuron__model_id.to(device)
+            hidden_neuron__out_bound = model_id__out_bound[hidden_neuron__model_id]
+            model_ids = torch.as_tensor(layer_ids, dtype=torch.long, device=device)
+            # Bool mask instead of torch.isin, which needs torch >= 1.10.
+            model_id__reset = torch.zeros(self.num_unique_models, dtype=torch.bool, device=device)
+            model_id__reset[model_ids] = True
+            neuron_ids = torch.where(model_id__reset[hidden_neuron__model_id])[0]
+            num_neurons = len(neuron_ids)
+
+            self.hidden_layer.weight[neuron_ids, :] = torch.empty(
+                num_neurons, self.in_features, device=device
+            ).uniform_(-hidden_bound, hidden_bound)
+            self.hidden_layer.bias[neuron_ids] = torch.empty(num_neurons, device=device).uniform_(
+                -hidden_bound, hidden_bound
+            )
+            self.weight[:, neuron_ids] = torch.empty(
+                self.out_features, num_neurons, device=device
+            ).uniform_(-1, 1) * hidden_neuron__out_bound[None, neuron_ids]
+            if self.bias is not None:
+                self.bias[model_ids, :] = torch.empty(
+                    len(model_ids), self.out_features, device=device
+                ).uniform_(-1, 1) * model_id__out_bound[model_ids, None]
 
     def apply_activations(self, x: Tensor) -> Tensor:
-        tensors = x.split(self.activations_split, dim=1)
-        output = []
-        sub_tensor_out_features = tensors[0].shape[1]
-        for (act, sub_tensor) in zip(self.activations, tensors):
-            if sub_tensor.shape[1] != sub_tensor_out_features:
-                raise RuntimeError(
-                    f"sub_tensors with different number of parameters per activation {[t.shape for t in tensors]}"
-                )
-            output.append(act(sub_tensor))
-        output = torch.cat(output, dim=1)
-        return output
+        if self.num_activations == 1:
+            return self.activations[0](x)
+
+        if not torch.is_grad_enabled():
+            # Nothing is saved for backward, so the hidden tensor can be activated in place.
+            for act, start, end in self.activation_slices:
+                if not isinstance(act, nn.Identity):
+                    x[:, start:end] = act(x[:, start:end])
+            return x
+
+        # split/cat rather than slice assignment: their backward is a single cat, while each slice
+        # would zero-fill a full [batch_size, total_hidden_neurons] gradient.
+        return torch.cat(
+            [act(sub_tensor) for act, sub_tensor in zip(self.activations, x.split(self.activations_split, dim=1))],
+            dim=1,
+        )
 
     def forward(self, x: Tensor) -> Tensor:
         batch_size = x.shape[0]
-        x = self.hidden_layer(x)  # [batch_size, total_hidden_neurons]
-        x = self.apply_activations(x)  # [batch_size, total_hidden_neurons]
-
-        x = (
-            x[:, :, None] * self.weight.T[None, :, :]
-        )  # [batch_size, total_hidden_neurons, out_features]
-
-        # [batch_size, total_repetitions, num_architectures, out_features]
-        adjusted_out = (
-            torch.zeros(
-                batch_size, self.num_unique_models, self.out_features, device=x.device
-            ).scatter_add_(
-                1,
-                # self.hidden_neuron__layer_id,
-                self.hidden_neuron__model_id[None, :, None].expand(
-                    batch_size, -1, self.out_features
-                ),
-                x,
-            )
-        ) + self.bias[None, :, :]
+        # Only open an autocast region when asked to, so a caller's own autocast region still applies.
+        autocast = (
+            torch.autocast(device_type=x.device.type, dtype=torch.bfloat16)
+            if self.mixed_precision
+            else contextlib.nullcontext()
+        )
+        with autocast:
+            x = self.hidden_layer(x)  # [batch_size, total_hidden_neurons]
+            x = self.apply_activations(x)  # [batch_size, total_hidden_neurons]
+
+            # Each model's hidden neurons only feed its own outputs, so the output layer is block-diagonal:
+            # one bmm per group of models sharing the same number of hidden neurons. The neurons are gathered
+            # group after group once, and split into views, so backward is a single scatter plus a cat.
+            weight = self.weight
+            if self.size_class__neuron_ids is not None:
+                x = x[:, self.size_class__neuron_ids]
+                weight = weight[:, self.size_class__neuron_ids]
+
+            outputs = []
+            for group_hidden, group_weight, (num_models, num_neurons) in zip(
+                x.split(self.size_class__split_sizes, dim=1),
+                weight.T.split(self.size_class__split_sizes, dim=0),
+                self.size_classes,
+            ):
+                group_hidden = group_hidden.reshape(batch_size, num_models, num_neurons).transpose(0, 1)  # [num_models, batch_size, num_neurons]
+                group_weight = group_weight.reshape(num_models, num_neurons, self.out_features)
+                outputs.append(torch.bmm(group_hidden, group_weight))  # [num_models, batch_size, out_features]
+
+            adjusted_out = torch.cat(outputs, dim=0)
+            if self.size_class__model_position is not None:
+                adjusted_out = adjusted_out[self.size_class__model_position]
+
+        # Bias is added in the parameters' dtype even when the matmuls ran in bf16.
+        adjusted_out = adjusted_out.to(self.weight.dtype).transpose(0, 1) + self.bias[None, :, :]
 
         # [batch_size, num_unique_models, out_features]
         return adjusted_out
@@ -220,20 +307,19 @@ class ParallelMLPs(nn.Module):
             )
 
         with torch.no_grad():
-            model_neurons = self.hidden_neuron__model_id == model_id
-            hidden_weight = self.hidden_layer.weight[model_neurons, :]
-            hidden_bias = self.hidden_layer.bias[model_neurons]
+            # Neurons of a model are contiguous, so [start, end) offsets slice them without building masks.
+            start = self.model_id__start_idx[model_id].item()
+            end = self.model_id__end_idx[model_id].item()
+            hidden_weight = self.hidden_layer.weight[start:end, :]
+            hidden_bias = self.hidden_layer.bias[start:end]
 
-            out_weight = self.weight[:, model_neurons]
+            out_weight = self.weight[:, start:end]
             out_bias = self.bias[model_id, :]
 
             hidden_layer = nn.Linear(
                 in_features=hidden_weight.shape[1], out_features=hidden_weight.shape[0]
             )
-            activation_index = (
-                torch.nonzero(self.hidden_neuron__model_id == model_id)[0]
-                // self.activations_split
-            )
+            activation_index = start // self.activations_split
             activation = deepcopy(self.activations[activation_index])
             out_layer = nn.Linear(
                 in_features=hidden_layer.out_features, out_features=self.out_features
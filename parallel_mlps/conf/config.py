@@ -43,6 +43,8 @@ class ModelConfig:
     loss_rel_tol: float
     min_improvement: float
     device: str
+    compile_forward: bool
+    mixed_precision: bool
 
 
 @dataclass
@@ -3,6 +3,29 @@ import numpy as np
 import pycm
 
 
+def matthews_corrcoef(confusion_matrix):
+    """Multiclass MCC computed from an already built confusion matrix (same formula as sklearn's).
+
+    Args:
+        confusion_matrix (np.ndarray): [n_classes, n_classes] matrix with targets on rows and predictions on columns.
+
+    Returns:
+        float: Matthews correlation coefficient, 0.0 when undefined.
+    """
+    t_sum = confusion_matrix.sum(axis=1, dtype=np.float64)
+    p_sum = confusion_matrix.sum(axis=0, dtype=np.float64)
+    n_correct = np.trace(confusion_matrix)
+    n_samples = p_sum.sum()
+    cov_ytyp = n_correct * n_samples - np.dot(t_sum, p_sum)
+    cov_ypyp = n_samples ** 2 - np.dot(p_sum, p_sum)
+    cov_ytyt = n_samples ** 2 - np.dot(t_sum, t_sum)
+
+    if cov_ypyp * cov_ytyt == 0:
+        return 0.0
+
+    return cov_ytyp / np.sqrt(cov_ytyt * cov_ypyp)
+
+
 def assess_model(logits, y_labels, metric_prefix):
     if not isinstance(logits, dict):
         logits = {"": logits}
@@ -28,8 +51,9 @@ def assess_model(logits, y_labels, metric_prefix):
         metrics[f"{metric_prefix}_{model}_aucroc_samples"] = float(
             sklearn.metrics.roc_auc_score(y, tmp_logits, average="samples")
         )
+        # Reusing pycm's matrix instead of letting sklearn build a second one.
         metrics[f"{metric_prefix}_{model}_matthews_corrcoef"] = float(
-            sklearn.metrics.matthews_corrcoef(y_labels, tmp_logits_labels)
+            matthews_corrcoef(cm.to_array())
         )
         metrics[f"{metric_prefix}_{model}_overall_acc"] = cm.Overall_ACC
         metrics[f"{metric_prefix}_{model}_f1_macro"] = cm.F1_Macro
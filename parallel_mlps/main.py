@@ -119,6 +119,8 @@ def run_single_experiment(data: Dict, cfg: AutoConstructiveConfig, logger: Any):
         loss_rel_tol=cfg.model.loss_rel_tol,
         min_improvement=cfg.model.min_improvement,
         device=cfg.model.device,
+        compile_forward=cfg.model.compile_forward,
+        mixed_precision=cfg.model.mixed_precision,
         random_state=random_state,
         logger=logger,
     )
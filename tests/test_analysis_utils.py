@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import wilcoxon
+
+"""Tests for `analysis.analysis_utils`."""
+
+pytest.importorskip("wandb")
+from analysis.analysis_utils import WILCOXON_COLUMNS, wilcoxon_tests
+
+METRIC = "overall_acc"
+G1 = f"model_autoconstructive_{METRIC}"
+
+
+@pytest.fixture
+def runs():
+    # fmt: off
+    g1_d1 = np.array([0.90, 0.91, 0.92, 0.93, 0.94, 0.95, 0.96, 0.97])
+    svm_d1 = g1_d1 - np.array([0.01, 0.02, 0.03, 0.04, 0.05, 0.06, 0.07, 0.08])
+    rf_d1 = g1_d1 + np.array([0.03, -0.01, 0.05, np.nan, -0.02, 0.04, 0.06, -0.07])
+    g1_d2 = np.array([0.5, 0.6, 0.7])
+    # Dyadic values on d3 keep the differences exact, so its ties are real ties.
+    g1_d3 = 0.5 + np.arange(20) / 64
+    svm_d3 = g1_d3 - np.arange(1, 21) / 128  # Tie-free differences.
+    rf_d3 = g1_d3 + np.array([1, -1, 2, 2, -3, 0, 4, 4, -1, 3, 5, -2, 6, 6, -4, 7, 1, 8, -5, 9]) / 16
+    # fmt: on
+    return pd.DataFrame(
+        {
+            "project": ["p"] * 31,
+            "dataset_name": ["d1"] * 8 + ["d2"] * 3 + ["d3"] * 20,
+            G1: np.concatenate([g1_d1, g1_d2, g1_d3]),
+            "svm": np.concatenate([svm_d1, g1_d2, svm_d3]),  # Equal to G1 on d2.
+            "rf": np.concatenate([rf_d1, [0.4, np.nan, np.nan], rf_d3]),  # A single run on d2.
+        }
+    )
+
+
+def _row(df, dataset_name, g2):
+    rows = df[(df["dataset_name"] == dataset_name) & (df["g2"] == g2)]
+    assert len(rows) == 1
+    return rows.iloc[0]
+
+
+def test_wilcoxon_tests(runs):
+    df = wilcoxon_tests(runs, METRIC)
+
+    assert list(df.columns) == WILCOXON_COLUMNS
+    # (G1, rf) on d2 is skipped, since rf has a single run there.
+    assert len(df) == 5
+    for column in ["project", "dataset_name", "g1", "g2"]:
+        assert isinstance(df[column].dtype, pd.CategoricalDtype)
+    assert (df["g1"] == G1).all()
+    assert df["g1_mean"].dtype == np.float32
+
+    d1 = runs[runs["dataset_name"] == "d1"]
+    row = _row(df, "d1", "svm")
+    statistic, p_value = wilcoxon(d1[G1], d1["svm"])
+    assert row["statistic"] == pytest.approx(statistic)
+    assert row["p-value"] == pytest.approx(p_value)
+    assert row["wilcoxon_result"] == "w"
+    assert row["g1_count"] == 8 and row["g2_count"] == 8
+    assert row["g1_mean"] == pytest.approx(d1[G1].mean())
+    assert row["g1_std"] == pytest.approx(d1[G1].std(ddof=0))
+
+
+def test_wilcoxon_tests_nan_pairing(runs):
+    # Runs are paired by row, and a pair with a NaN on either side is dropped.
+    df = wilcoxon_tests(runs, METRIC)
+
+    d1 = runs[runs["dataset_name"] == "d1"]
+    paired = d1[[G1, "rf"]].dropna()
+    row = _row(df, "d1", "rf")
+    statistic, p_value = wilcoxon(paired[G1], paired["rf"])
+    assert row["statistic"] == pytest.approx(statistic)
+    assert row["p-value"] == pytest.approx(p_value)
+    assert p_value >= 0.05
+    assert row["wilcoxon_result"] == "d"
+    # Counts and moments still use every non-NaN run of each group.
+    assert row["g1_count"] == 8 and row["g2_count"] == 7
+    assert row["g2_mean"] == pytest.approx(d1["rf"].mean())
+    assert row["g2_std"] == pytest.approx(d1["rf"].std(ddof=0))
+
+
+def test_wilcoxon_tests_identical_groups(runs):
+    # Groups without any difference are not tested and get the 999 sentinels.
+    df = wilcoxon_tests(runs, METRIC)
+
+    row = _row(df, "d2", "svm")
+    assert row["statistic"] == 999
+    assert row["p-value"] == 999
+    assert row["wilcoxon_result"] == "d"
+
+
+def test_wilcoxon_tests_ties_do_not_leak(runs):
+    # With 14-50 runs, a tied pair must not push its tie-free neighbours off the exact test.
+    df = wilcoxon_tests(runs, METRIC)
+
+    d3 = runs[runs["dataset_name"] == "d3"]
+    for g2 in ["svm", "rf"]:
+        row = _row(df, "d3", g2)
+        statistic, p_value = wilcoxon(d3[G1], d3[g2])
+        assert row["statistic"] == pytest.approx(statistic)
+        assert row["p-value"] == pytest.approx(p_value)
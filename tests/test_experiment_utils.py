@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+
+from parallel_mlps.experiment_utils import matthews_corrcoef
+import numpy as np
+import pytest
+import sklearn.metrics
+
+"""Tests for `parallel_mlps.experiment_utils`."""
+
+
+@pytest.mark.parametrize(
+    "y_true,y_pred",
+    [
+        # Perfect and perfectly inverted binary predictions.
+        ([0, 1, 1, 0], [0, 1, 1, 0]),
+        ([0, 1, 1, 0], [1, 0, 0, 1]),
+        # A single predicted class: the prediction variance is zero, so MCC is undefined.
+        ([0, 1, 2, 1, 0], [1, 1, 1, 1, 1]),
+        # A single target class.
+        ([2, 2, 2, 2], [0, 2, 1, 2]),
+        # Only one class in both targets and predictions.
+        ([1, 1, 1], [1, 1, 1]),
+        # Multiclass.
+        ([0, 1, 2, 0, 1, 2, 2, 1], [0, 2, 2, 0, 1, 1, 2, 0]),
+    ],
+)
+def test_matthews_corrcoef(y_true, y_pred):
+    labels = np.union1d(y_true, y_pred)
+    cm = sklearn.metrics.confusion_matrix(y_true, y_pred, labels=labels)
+
+    expected = sklearn.metrics.matthews_corrcoef(y_true, y_pred)
+    assert matthews_corrcoef(cm) == pytest.approx(expected, abs=1e-12)
+
+
+def test_matthews_corrcoef_random():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        n_classes = rng.integers(2, 6)
+        y_true = rng.integers(0, n_classes, size=50)
+        y_pred = np.where(rng.random(50) < 0.5, y_true, rng.integers(0, n_classes, size=50))
+        cm = sklearn.metrics.confusion_matrix(y_true, y_pred, labels=np.arange(n_classes))
+
+        expected = sklearn.metrics.matthews_corrcoef(y_true, y_pred)
+        assert matthews_corrcoef(cm) == pytest.approx(expected, abs=1e-12)
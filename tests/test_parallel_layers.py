@@ -6,6 +6,8 @@ from parallel_mlps.autoconstructive.model.parallel_mlp import (
     ParallelMLPs,
     build_model_ids,
 )
+from collections import defaultdict
+from copy import deepcopy
 import pytest
 import torch
 from torch import nn
@@ -38,6 +40,12 @@ N_OUTPUTS = 2
 MIN_NEURONS = 1
 MAX_NEURONS = 3
 
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+requires_module_compile = pytest.mark.skipif(
+    not hasattr(nn.Module, "compile"), reason="nn.Module.compile needs torch >= 2.2"
+)
+
 
 @pytest.fixture
 def X():
@@ -55,25 +63,38 @@ def activation_functions():
 
 
 @pytest.fixture
-def parallel_mlp_object(activation_functions, X):
-    hidden_neuron__model_id, outputs_ids, architecture_ids = build_model_ids(
-        repetitions=3,
-        activation_functions=activation_functions,
-        min_neurons=MIN_NEURONS,
-        max_neurons=MAX_NEURONS,
-        step=1,
-    )
+def make_parallel_mlp(activation_functions):
+    """Builds a ParallelMLPs on DEVICE; keyword arguments are forwarded to ParallelMLPs."""
+
+    def make(activations=None, repetitions=3, **kwargs):
+        activations = activation_functions if activations is None else activations
+        hidden_neuron__model_id, outputs_ids, architecture_ids = build_model_ids(
+            repetitions=repetitions,
+            activation_functions=activations,
+            min_neurons=MIN_NEURONS,
+            max_neurons=MAX_NEURONS,
+            step=1,
+        )
+        kwargs.setdefault("device", DEVICE)
+
+        return ParallelMLPs(
+            in_features=N_FEATURES,
+            out_features=N_OUTPUTS,
+            bias=True,
+            hidden_neuron__model_id=hidden_neuron__model_id,
+            output__model_id=outputs_ids,
+            output__architecture_id=architecture_ids,
+            activations=activations,
+            logger=logger,
+            **kwargs,
+        )
+
+    return make
 
-    return ParallelMLPs(
-        in_features=X.shape[1],
-        out_features=N_OUTPUTS,
-        bias=True,
-        hidden_neuron__model_id=hidden_neuron__model_id,
-        output__model_id=outputs_ids,
-        output__architecture_id=architecture_ids,
-        activations=activation_functions,
-        logger=logger,
-    )
+
+@pytest.fixture
+def parallel_mlp_object(make_parallel_mlp):
+    return make_parallel_mlp()
 
 
 @pytest.mark.parametrize(
@@ -198,27 +219,157 @@ def test_fail_build_model_ids():
         )
 
 
-def test_parallel_single_mlps_forward(parallel_mlp_object: ParallelMLPs, X: Tensor):
-    output = parallel_mlp_object(X)
-    for i in parallel_mlp_object.unique_model_ids:
-        mlp = parallel_mlp_object.extract_mlp(i)
-        output_mlp = mlp(X)
-        assert torch.allclose(output[:, i, :], output_mlp)
+def test_construction_does_not_read_device(make_parallel_mlp):
+    # Meta tensors hold no data, so any device -> host read during __init__ would raise here.
+    pmlps = make_parallel_mlp(device="meta")
+    assert pmlps.model_id__num_hidden_neurons.device.type == "meta"
+    assert pmlps.size_class__neuron_ids.device.type == "meta"
 
 
-def test_trainings(X, Y, parallel_mlp_object: ParallelMLPs):
+def test_parallel_single_mlps_forward(parallel_mlp_object: ParallelMLPs, X: Tensor):
+    X = X.to(parallel_mlp_object.device)
+    output = parallel_mlp_object(X)
+    mlps = [parallel_mlp_object.extract_mlp(i).to(X.device) for i in parallel_mlp_object.unique_model_ids]
+    output_mlps = torch.stack([mlp(X) for mlp in mlps], dim=1)
+    assert torch.allclose(output, output_mlps)
+
+
+@requires_module_compile
+def test_compiled_forward(make_parallel_mlp, X: Tensor):
+    pmlps = make_parallel_mlp(compile_forward=True)
+    X = X.to(pmlps.device)
+
+    output = pmlps(X)
+    mlps = [pmlps.extract_mlp(i).to(X.device) for i in pmlps.unique_model_ids]
+    output_mlps = torch.stack([mlp(X) for mlp in mlps], dim=1)
+    assert torch.allclose(output, output_mlps, atol=1e-6)
+
+    # The copy must run its own parameters, not the compiled forward of the original module.
+    pmlps_copy = deepcopy(pmlps)
+    with torch.no_grad():
+        pmlps_copy.bias.add_(1.0)
+    assert torch.allclose(pmlps_copy(X), output + 1.0, atol=1e-6)
+    assert torch.allclose(pmlps(X), output)
+
+
+def test_no_grad_forward(make_parallel_mlp, X: Tensor):
+    pmlps = make_parallel_mlp(activations=[nn.Identity(), nn.GELU(), nn.Sigmoid()], repetitions=2)
+    X = X.to(pmlps.device)
+
+    # Without autograd the activations are applied in place, skipping the nn.Identity slice.
+    output = pmlps(X)
+    with torch.no_grad():
+        no_grad_output = pmlps(X)
+    assert torch.equal(no_grad_output, output.detach())
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float64])
+def test_output_dtype(make_parallel_mlp, X: Tensor, dtype):
+    pmlps = make_parallel_mlp().to(dtype)
+    X = X.to(pmlps.device, dtype)
+
+    output = pmlps(X)
+    assert output.dtype == dtype
+    mlps = [pmlps.extract_mlp(i).to(X.device, dtype) for i in pmlps.unique_model_ids]
+    output_mlps = torch.stack([mlp(X) for mlp in mlps], dim=1)
+    # A tolerance of a few ulps catches outputs that were silently rounded through fp32.
+    eps = torch.finfo(dtype).eps
+    assert torch.allclose(output, output_mlps, rtol=16 * eps, atol=16 * eps)
+
+
+def test_mixed_precision(make_parallel_mlp, X: Tensor):
+    pmlps = make_parallel_mlp()
+    X = X.to(pmlps.device)
+
+    output = pmlps(X)
+    pmlps.mixed_precision = True
+    mixed_output = pmlps(X)
+    assert mixed_output.dtype == torch.float32
+    # bf16 keeps 8 bits of mantissa, so the outputs only agree to about 1e-2.
+    assert torch.allclose(mixed_output, output, atol=1e-2, rtol=1e-2)
+
+    mixed_output.sum().backward()
+    for param in pmlps.parameters():
+        assert param.grad.dtype == torch.float32
+
+
+def test_outer_autocast(make_parallel_mlp, X: Tensor):
+    pmlps = make_parallel_mlp()
+    X = X.to(pmlps.device)
+    hidden_dtypes = []
+    pmlps.hidden_layer.register_forward_hook(lambda module, inputs, output: hidden_dtypes.append(output.dtype))
+
+    # mixed_precision=False must not switch off an autocast region opened by the caller.
+    with torch.autocast(device_type=X.device.type, dtype=torch.bfloat16):
+        pmlps(X)
+    assert hidden_dtypes == [torch.bfloat16]
+
+
+def test_partial_reset_parameters(make_parallel_mlp):
+    pmlps = make_parallel_mlp()
+    # Values outside every init bound, so any reset entry is distinguishable from the untouched ones.
+    with torch.no_grad():
+        for param in pmlps.parameters():
+            param.fill_(10.0)
+    before = {name: param.clone() for name, param in pmlps.named_parameters()}
+
+    layer_ids = torch.tensor([1, 4, 11], device=pmlps.device)
+    pmlps.reset_parameters(layer_ids.tolist())
+
+    reset_models = torch.zeros(pmlps.num_unique_models, dtype=torch.bool, device=pmlps.device)
+    reset_models[layer_ids] = True
+    reset_neurons = reset_models[pmlps.hidden_neuron__model_id]
+    hidden_bound = 1 / N_FEATURES ** 0.5
+    out_bound = pmlps.model_id__num_hidden_neurons.float().rsqrt()
+
+    hidden_weight = pmlps.hidden_layer.weight
+    hidden_bias = pmlps.hidden_layer.bias
+    assert torch.equal(hidden_weight[~reset_neurons], before["hidden_layer.weight"][~reset_neurons])
+    assert torch.equal(hidden_bias[~reset_neurons], before["hidden_layer.bias"][~reset_neurons])
+    assert torch.equal(pmlps.weight[:, ~reset_neurons], before["weight"][:, ~reset_neurons])
+    assert torch.equal(pmlps.bias[~reset_models], before["bias"][~reset_models])
+
+    assert torch.all(hidden_weight[reset_neurons].abs() <= hidden_bound)
+    assert torch.all(hidden_bias[reset_neurons].abs() <= hidden_bound)
+    neuron_out_bound = out_bound[pmlps.hidden_neuron__model_id][reset_neurons]
+    assert torch.all(pmlps.weight[:, reset_neurons].abs() <= neuron_out_bound[None, :])
+    assert torch.all(pmlps.bias[reset_models].abs() <= out_bound[reset_models, None])
+
+
+@pytest.mark.parametrize("compile_model", [False, pytest.param(True, marks=requires_module_compile)])
+def test_trainings(X, Y, parallel_mlp_object: ParallelMLPs, compile_model):
+    # torch.func needs torch >= 2.0, so it is only imported by the test that stacks the reference models.
+    torch_func = pytest.importorskip("torch.func")
+    functional_call, stack_module_state, vmap = (
+        torch_func.functional_call,
+        torch_func.stack_module_state,
+        torch_func.vmap,
+    )
     reproducibility()
     lr = 1
     atol = 1e-8
     rtol = 0.99
     parallel_optimizer = Adam(params=parallel_mlp_object.parameters(), lr=lr)
+    if compile_model:
+        # Shapes are fixed across epochs, so the parallel forward can be compiled once.
+        parallel_mlp_object.compile(dynamic=False, mode="reduce-overhead")
 
     single_models = [
         parallel_mlp_object.extract_mlp(i) for i in parallel_mlp_object.unique_model_ids
     ]
-    single_optimizers = [
-        Adam(params=model.parameters(), lr=lr) for model in single_models
-    ]
+
+    # Reference models sharing the same architecture (activation and number of hidden neurons) are stacked
+    # and trained together with a single vmapped call instead of one tiny forward/backward per model.
+    architecture__model_ids = defaultdict(list)
+    for i, model in enumerate(single_models):
+        architecture__model_ids[(type(model[1]), model[0].out_features)].append(i)
+
+    stacked_models = []
+    for model_ids in architecture__model_ids.values():
+        params, buffers = stack_module_state([single_models[i] for i in model_ids])
+        base_model = deepcopy(single_models[model_ids[0]]).to("meta")
+        optimizer = Adam(params=params.values(), lr=lr)
+        stacked_models.append((model_ids, base_model, params, buffers, optimizer))
 
     num_epochs = 100
     parallel_loss = nn.CrossEntropyLoss(reduction="none")
@@ -241,20 +392,25 @@ def test_trainings(X, Y, parallel_mlp_object: ParallelMLPs):
         print(candidate_losses)
         print(parallel_mlp_object.hidden_layer.weight.mean())
 
-        for i, (model, optimizer) in enumerate(zip(single_models, single_optimizers)):
+        for model_ids, base_model, params, buffers, optimizer in stacked_models:
             optimizer.zero_grad()
-            single_outputs = model(X)
-            loss = sequential_loss(single_outputs, Y)
-            loss.backward()
+
+            def compute_loss(params, buffers):
+                single_outputs = functional_call(base_model, (params, buffers), (X,))
+                return sequential_loss(single_outputs, Y)
+
+            losses = vmap(compute_loss)(params, buffers)  # [len(model_ids)]
+            losses.sum().backward()
             optimizer.step()
 
             # Asserts
-            assert torch.allclose(candidate_losses[i], loss, atol=atol, rtol=rtol)
+            assert torch.allclose(candidate_losses[model_ids], losses, atol=atol, rtol=rtol)
 
-            m = parallel_mlp_object.extract_mlp(i)
-            # assert torch.allclose(m[0].weight, model[0].weight, atol=atol, rtol=rtol)
-            assert type(m[1]) == type(model[1])
-            # assert torch.allclose(m[2].weight, model[2].weight, atol=atol, rtol=rtol)
+            for i in model_ids:
+                m = parallel_mlp_object.extract_mlp(i)
+                # assert torch.allclose(m[0].weight, model[0].weight, atol=atol, rtol=rtol)
+                assert type(m[1]) == type(base_model[1])
+                # assert torch.allclose(m[2].weight, model[2].weight, atol=atol, rtol=rtol)
 
 
 @pytest.fixture